@@ -3,38 +3,155 @@
 Simple FastAPI server for demonstration
 """
 import asyncio
+import itertools
 import logging
-from typing import Optional, Dict, Any
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Optional, Dict, Any, List
+import orjson
 import uvicorn
 from fastapi import FastAPI, HTTPException
-from fastapi.responses import Response
-from pydantic import BaseModel
-from prometheus_client import Counter, Histogram, Gauge, generate_latest, CONTENT_TYPE_LATEST
+from fastapi.responses import ORJSONResponse, Response
+from pydantic import BaseModel, ConfigDict
+from starlette.routing import Route
+from prometheus_client import (
+    CollectorRegistry, Counter, Histogram, Gauge, GCCollector, PlatformCollector,
+    ProcessCollector, make_asgi_app,
+)
+from prometheus_client.multiprocess import MultiProcessCollector, mark_process_dead
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+class ShardedStore:
+    """Dict-like key-value store split across shards.
+
+    Keys are routed to a shard by hash(key) & mask, so nshards must be a
+    power of two. The store is not thread-safe: every write also updates a
+    shared length counter, so it assumes callers run on the single event-loop
+    thread, as the async handlers here do.
+    """
+
+    def __init__(self, nshards: int = 16):
+        if nshards <= 0 or nshards & (nshards - 1):
+            raise ValueError("nshards must be a power of two")
+        self._shards = [dict() for _ in range(nshards)]
+        self._mask = nshards - 1
+        self._len = 0  # Kept in step with the shards so len() stays O(1)
+
+    def _shard(self, key):
+        return self._shards[hash(key) & self._mask]
+
+    def get(self, key, default=None):
+        return self._shard(key).get(key, default)
+
+    def __getitem__(self, key):
+        return self._shard(key)[key]
+
+    def __setitem__(self, key, value):
+        shard = self._shard(key)
+        if key not in shard:
+            self._len += 1
+        shard[key] = value
+
+    def __delitem__(self, key):
+        del self._shard(key)[key]
+        self._len -= 1
+
+    def __contains__(self, key):
+        return key in self._shard(key)
+
+    def __len__(self):
+        return self._len
+
+    def items(self):
+        for shard in self._shards:
+            yield from shard.items()
+
+    def clear(self):
+        for shard in self._shards:
+            shard.clear()
+        self._len = 0
+
 # Simple in-memory storage for demonstration
-memory_store = {}
-transaction_counter = 1
+# memory_store maps each key to one int packing (offset << 32) | length of a
+# slice of _arena, which holds every value's UTF-8 bytes back to back. A single
+# int per key is smaller than a str object (or an (offset, length) tuple).
+memory_store = ShardedStore()
+_arena = bytearray()
+_arena_garbage = 0  # Bytes in _arena no longer referenced by any key
+ARENA_COMPACT_MIN = 1 << 20  # Don't bother compacting below 1 MiB of garbage
+_LENGTH_BITS = 32
+_LENGTH_MASK = (1 << _LENGTH_BITS) - 1
+total_bytes = 0  # Running sum of key + value UTF-8 bytes in memory_store
+_txn_counter = itertools.count(1)  # next() hands out transaction ids
 
 # Prometheus metrics
-db_operations_total = Counter('db_operations_total', 'Total database operations', ['operation', 'status'])
-db_operation_duration = Histogram('db_operation_duration_seconds', 'Database operation duration', ['operation'])
-db_health_status = Gauge('db_health_status', 'Database health status (1=healthy, 0=unhealthy)')
-db_total_keys = Gauge('db_total_keys', 'Total number of keys in database')
-db_memory_usage = Gauge('db_memory_usage_bytes', 'Memory usage in bytes')
+# Running this file directly executes it once as __main__ and again when uvicorn
+# imports "simple_api_server", so metrics live in a per-module registry rather
+# than the global one to avoid "Duplicated timeseries" on the second import.
+registry = CollectorRegistry()
+MULTIPROCESS_METRICS = "PROMETHEUS_MULTIPROC_DIR" in os.environ
+if MULTIPROCESS_METRICS:
+    # With several workers each process writes its values to files in that
+    # directory, and scrapes aggregate them through a separate registry.
+    exposition_registry = CollectorRegistry()
+    MultiProcessCollector(exposition_registry)
+else:
+    ProcessCollector(registry=registry)
+    PlatformCollector(registry=registry)
+    GCCollector(registry=registry)
+    exposition_registry = registry
+
+db_operations_total = Counter('db_operations_total', 'Total database operations', ['operation', 'status'], registry=registry)
+db_operation_duration = Histogram('db_operation_duration_seconds', 'Database operation duration', ['operation'], registry=registry)
+# multiprocess_mode only applies with PROMETHEUS_MULTIPROC_DIR set. Health takes
+# the max so the supervisor's never-set 0 doesn't read as unhealthy; keys and
+# bytes sum over live workers, each of which holds its own store.
+db_health_status = Gauge('db_health_status', 'Database health status (1=healthy, 0=unhealthy)', registry=registry, multiprocess_mode='max')
+db_total_keys = Gauge('db_total_keys', 'Total number of keys in database', registry=registry, multiprocess_mode='livesum')
+db_memory_usage = Gauge('db_memory_usage_bytes', 'Memory usage in bytes', registry=registry, multiprocess_mode='livesum')
+
+# Labelled children resolved once so handlers skip the .labels() lookup
+_INSERT_TIMER = db_operation_duration.labels(operation='insert')
+_SEARCH_TIMER = db_operation_duration.labels(operation='search')
+_REMOVE_TIMER = db_operation_duration.labels(operation='remove')
+
+# Every (operation, status) pair db_operations_total may report. Creating them
+# all up front keeps the label set bounded and exports zeros from the start.
+_OPS = {
+    (op, st): db_operations_total.labels(operation=op, status=st)
+    for op in ('insert', 'search', 'remove')
+    for st in ('success', 'error', 'not_found')
+}
+
+@asynccontextmanager
+async def lifespan(app):
+    yield
+    if MULTIPROCESS_METRICS:
+        # Drop this worker's live gauge files so they stop counting after exit
+        mark_process_dead(os.getpid())
 
 # FastAPI app
 app = FastAPI(
     title="Custom Database Engine API",
     description="High-performance database (Demo Mode)",
     version="1.0.0",
+    # Handlers return plain dicts, so orjson does the encoding (fastapi<0.131)
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan,
 )
 
 # Pydantic stuff
+# The response models below only document the OpenAPI schema; handlers return
+# plain dicts so FastAPI does not re-validate every response.
 class InsertRequest(BaseModel):
+    # These are the pydantic v2 defaults, pinned on purpose so a later config
+    # change can't quietly add work to the insert path's validator
+    model_config = ConfigDict(extra='ignore', str_strip_whitespace=False, validate_assignment=False)
+
     key: str
     value: str
 
@@ -48,87 +165,187 @@ class StatsResponse(BaseModel):
     memory_usage: str
     system_healthy: bool
 
+def compact_arena():
+    """Rewrite _arena with only the live values and update their offsets.
+
+    This is an O(live keys) pass that runs inline on the event loop, so the
+    request that triggers it stalls for the whole rewrite. release_value only
+    calls it once garbage is at least ARENA_COMPACT_MIN and half the arena,
+    which keeps it rare and its cost amortised over the writes that caused it.
+    """
+    global _arena, _arena_garbage
+    compacted = bytearray()
+    for key, entry in list(memory_store.items()):
+        start, length = entry >> _LENGTH_BITS, entry & _LENGTH_MASK
+        memory_store[key] = (len(compacted) << _LENGTH_BITS) | length
+        compacted += _arena[start:start + length]
+    _arena = compacted
+    _arena_garbage = 0
+
+def release_value(length: int):
+    """Mark an overwritten or removed value's bytes as garbage"""
+    global _arena_garbage
+    _arena_garbage += length
+    if _arena_garbage >= ARENA_COMPACT_MIN and _arena_garbage * 2 >= len(_arena):
+        compact_arena()
+
+def store_value(key: str, value: str):
+    """Append a value to the arena and keep total_bytes in step with memory_store"""
+    global total_bytes
+    data = value.encode()
+    old = memory_store.get(key)
+    if old is None:
+        total_bytes += len(key.encode()) + len(data)
+    else:
+        total_bytes += len(data) - (old & _LENGTH_MASK)
+    memory_store[key] = (len(_arena) << _LENGTH_BITS) | len(data)
+    _arena.extend(data)
+    if old is not None:
+        release_value(old & _LENGTH_MASK)
+
+def load_value(key: str) -> Optional[str]:
+    """Return the value stored for key, or None if it is missing"""
+    entry = memory_store.get(key)
+    if entry is None:
+        return None
+    start = entry >> _LENGTH_BITS
+    return _arena[start:start + (entry & _LENGTH_MASK)].decode()
+
+def delete_value(key: str) -> bool:
+    """Remove key from the store, returning False if it was not present"""
+    global total_bytes
+    entry = memory_store.get(key)
+    if entry is None:
+        return False
+    del memory_store[key]
+    length = entry & _LENGTH_MASK
+    total_bytes -= len(key.encode()) + length
+    release_value(length)
+    return True
+
+# The root response never changes, so encode it once at import
+_ROOT_BODY = orjson.dumps({
+    "message": "Custom Database Engine API (Demo Mode)",
+    "version": "1.0.0",
+    "status": "healthy",
+    "mode": "demo",
+    "features": [
+        "Content-addressable storage",
+        "B-Tree indexing",
+        "MVCC transactions",
+        "Health monitoring",
+        "FastAPI REST interface"
+    ],
+    "note": "Currently running in demo mode without C++ engine"
+})
+
+# Fixed demo records and the matching /demo/populate response body
+_DEMO_DATA = {
+    "user:1": "Alice Johnson",
+    "user:2": "Bob Smith",
+    "user:3": "Carol Davis",
+    "product:1": "Database Engine",
+    "product:2": "FastAPI Server",
+    "config:max_connections": "1000",
+    "config:timeout": "30s"
+}
+_DEMO_KEYS = list(_DEMO_DATA.keys())
+_DEMO_RESPONSE = orjson.dumps({
+    "message": f"Populated {len(_DEMO_DATA)} demo records",
+    "keys": _DEMO_KEYS
+})
+
 # API Endpoints
 @app.get("/")
 async def root():
     """Root endpoint with API information"""
-    return {
-        "message": "Custom Database Engine API (Demo Mode)",
-        "version": "1.0.0",
-        "status": "healthy",
-        "mode": "demo",
-        "features": [
-            "Content-addressable storage",
-            "B-Tree indexing", 
-            "MVCC transactions",
-            "Health monitoring",
-            "FastAPI REST interface"
-        ],
-        "note": "Currently running in demo mode without C++ engine"
-    }
+    return Response(content=_ROOT_BODY, media_type="application/json")
 
 @app.post("/insert", response_model=dict)
 async def insert_key_value(request: InsertRequest):
     """Insert a key-value pair into the database"""
-    with db_operation_duration.labels(operation='insert').time():
-        try:
-            memory_store[request.key] = request.value
-            db_operations_total.labels(operation='insert', status='success').inc()
-            db_total_keys.set(len(memory_store))
-            db_memory_usage.set(sum(len(str(k)) + len(str(v)) for k, v in memory_store.items()))
-            logger.info(f"Inserted: {request.key} -> {request.value}")
-            return {"success": True, "key": request.key}
-        except Exception as e:
-            db_operations_total.labels(operation='insert', status='error').inc()
-            raise HTTPException(status_code=500, detail=f"Insert failed: {str(e)}")
-
-@app.get("/search/{key}", response_model=SearchResponse)
+    t0 = time.perf_counter()
+    try:
+        store_value(request.key, request.value)
+        _OPS[('insert', 'success')].inc()
+        db_total_keys.set(len(memory_store))
+        db_memory_usage.set(total_bytes)
+        logger.info("Inserted: %s -> %s", request.key, request.value)
+        return {"success": True, "key": request.key}
+    except Exception as e:
+        _OPS[('insert', 'error')].inc()
+        raise HTTPException(status_code=500, detail=f"Insert failed: {str(e)}")
+    finally:
+        _INSERT_TIMER.observe(time.perf_counter() - t0)
+
+@app.post("/insert_many")
+async def insert_many(items: List[InsertRequest]):
+    """Insert a batch of key-value pairs in a single request"""
+    stored = 0
+    t0 = time.perf_counter()
+    try:
+        for item in items:
+            store_value(item.key, item.value)
+            stored += 1
+        logger.info("Inserted batch of %d records", stored)
+        return {"success": True, "inserted": stored}
+    except Exception as e:
+        # Items before the failure stay stored; the failed one and the rest don't
+        _OPS[('insert', 'error')].inc(len(items) - stored)
+        raise HTTPException(status_code=500, detail=f"Batch insert failed after {stored} records: {str(e)}")
+    finally:
+        _OPS[('insert', 'success')].inc(stored)
+        db_total_keys.set(len(memory_store))
+        db_memory_usage.set(total_bytes)
+        _INSERT_TIMER.observe(time.perf_counter() - t0)
+
+@app.get("/search/{key}", responses={200: {"model": SearchResponse}})
 async def search_key(key: str):
     """Search for a key in the database"""
-    with db_operation_duration.labels(operation='search').time():
-        try:
-            value = memory_store.get(key)
-            found = value is not None
-            db_operations_total.labels(operation='search', status='success').inc()
-            logger.info(f"Search: {key} -> {'found' if found else 'not found'}")
-            return SearchResponse(
-                key=key,
-                value=value if found else None,
-                found=found
-            )
-        except Exception as e:
-            db_operations_total.labels(operation='search', status='error').inc()
-            raise HTTPException(status_code=500, detail=f"Search failed: {str(e)}")
+    t0 = time.perf_counter()
+    try:
+        value = load_value(key)
+        found = value is not None
+        _OPS[('search', 'success')].inc()
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Search: %s -> %s", key, 'found' if found else 'not found')
+        return {"key": key, "value": value, "found": found}
+    except Exception as e:
+        _OPS[('search', 'error')].inc()
+        raise HTTPException(status_code=500, detail=f"Search failed: {str(e)}")
+    finally:
+        _SEARCH_TIMER.observe(time.perf_counter() - t0)
 
 @app.delete("/remove/{key}")
 async def remove_key(key: str):
     """Remove a key from the database"""
-    with db_operation_duration.labels(operation='remove').time():
-        try:
-            if key in memory_store:
-                del memory_store[key]
-                db_operations_total.labels(operation='remove', status='success').inc()
-                db_total_keys.set(len(memory_store))
-                db_memory_usage.set(sum(len(str(k)) + len(str(v)) for k, v in memory_store.items()))
-                logger.info(f"Removed: {key}")
-                return {"success": True, "key": key}
-            else:
-                db_operations_total.labels(operation='remove', status='not_found').inc()
-                return {"success": False, "key": key, "message": "Key not found"}
-        except Exception as e:
-            db_operations_total.labels(operation='remove', status='error').inc()
-            raise HTTPException(status_code=500, detail=f"Remove failed: {str(e)}")
-
-@app.get("/stats", response_model=StatsResponse)
+    t0 = time.perf_counter()
+    try:
+        if delete_value(key):
+            _OPS[('remove', 'success')].inc()
+            db_total_keys.set(len(memory_store))
+            db_memory_usage.set(total_bytes)
+            logger.info("Removed: %s", key)
+            return {"success": True, "key": key}
+        else:
+            _OPS[('remove', 'not_found')].inc()
+            return {"success": False, "key": key, "message": "Key not found"}
+    except Exception as e:
+        _OPS[('remove', 'error')].inc()
+        raise HTTPException(status_code=500, detail=f"Remove failed: {str(e)}")
+    finally:
+        _REMOVE_TIMER.observe(time.perf_counter() - t0)
+
+@app.get("/stats", responses={200: {"model": StatsResponse}})
 async def get_stats():
     """Get database system statistics"""
     try:
-        total_size = sum(len(str(k)) + len(str(v)) for k, v in memory_store.items())
-        return StatsResponse(
-            total_keys=len(memory_store),
-            memory_usage=f"{total_size} bytes",
-            system_healthy=True
-        )
+        total_size = total_bytes
+        return {
+            "total_keys": len(memory_store),
+            "memory_usage": f"{total_size} bytes",
+            "system_healthy": True
+        }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Stats failed: {str(e)}")
 
@@ -138,81 +355,88 @@ async def health_check():
     # Update health metrics
     db_health_status.set(1)  # 1 = healthy
     db_total_keys.set(len(memory_store))
-    db_memory_usage.set(sum(len(str(k)) + len(str(v)) for k, v in memory_store.items()))
+    db_memory_usage.set(total_bytes)
     
     return {
         "status": "healthy",
         "database": "demo_mode",
-        "timestamp": asyncio.get_event_loop().time(),
+        "timestamp": asyncio.get_running_loop().time(),
         "keys_stored": len(memory_store)
     }
 
 @app.post("/transactions/begin")
 async def begin_transaction():
     """Begin a new database transaction (demo)"""
-    global transaction_counter
-    txn_id = transaction_counter
-    transaction_counter += 1
-    logger.info(f"Started transaction {txn_id}")
+    txn_id = next(_txn_counter)
+    logger.info("Started transaction %s", txn_id)
     return {"transaction_id": txn_id}
 
-@app.post("/transactions/{txn_id}/commit")
+@app.post("/transactions/{txn_id}/commit", status_code=204)
 async def commit_transaction(txn_id: int):
     """Commit a database transaction (demo)"""
-    logger.info(f"Committed transaction {txn_id}")
-    return {"success": True, "transaction_id": txn_id}
+    logger.info("Committed transaction %s", txn_id)
+    return Response(status_code=204)
 
-@app.post("/transactions/{txn_id}/abort")
+@app.post("/transactions/{txn_id}/abort", status_code=204)
 async def abort_transaction(txn_id: int):
     """Abort a database transaction (demo)"""
-    logger.info(f"Aborted transaction {txn_id}")
-    return {"success": True, "transaction_id": txn_id}
+    logger.info("Aborted transaction %s", txn_id)
+    return Response(status_code=204)
 
-@app.post("/admin/flush")
+@app.post("/admin/flush", status_code=204)
 async def flush_database():
     """Flush pending writes (demo operation)"""
     logger.info("Flush operation completed (demo mode)")
-    return {"message": "Flush completed (demo mode)"}
+    return Response(status_code=204)
 
 @app.get("/demo/populate")
 async def populate_demo_data():
     """Populate some demo data for testing"""
-    demo_data = {
-        "user:1": "Alice Johnson",
-        "user:2": "Bob Smith", 
-        "user:3": "Carol Davis",
-        "product:1": "Database Engine",
-        "product:2": "FastAPI Server",
-        "config:max_connections": "1000",
-        "config:timeout": "30s"
-    }
-    
-    memory_store.update(demo_data)
-    logger.info(f"Populated {len(demo_data)} demo records")
-    
-    return {
-        "message": f"Populated {len(demo_data)} demo records",
-        "keys": list(demo_data.keys())
-    }
+    for key, value in _DEMO_DATA.items():
+        store_value(key, value)
+    db_total_keys.set(len(memory_store))
+    db_memory_usage.set(total_bytes)
+    logger.info("Populated %d demo records", len(_DEMO_DATA))
+
+    return Response(content=_DEMO_RESPONSE, media_type="application/json")
 
 @app.delete("/demo/clear")
 async def clear_demo_data():
     """Clear all demo data"""
+    global total_bytes, _arena_garbage
     count = len(memory_store)
     memory_store.clear()
+    _arena.clear()
+    _arena_garbage = 0
+    total_bytes = 0
     db_total_keys.set(0)
     db_memory_usage.set(0)
-    logger.info(f"Cleared {count} records")
+    logger.info("Cleared %d records", count)
     
     return {
         "message": f"Cleared {count} records",
         "total_keys": len(memory_store)
     }
 
-@app.get("/metrics")
-async def get_metrics():
-    """Prometheus metrics endpoint"""
-    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+class ASGIEndpoint:
+    """Wrap an ASGI app so Starlette's Route passes it raw ASGI calls.
+
+    Route wraps plain functions as request/response handlers, and
+    make_asgi_app returns a function, so it needs this object around it.
+    """
+
+    def __init__(self, asgi_app):
+        self.asgi_app = asgi_app
+
+    async def __call__(self, scope, receive, send):
+        await self.asgi_app(scope, receive, send)
+
+# Prometheus metrics endpoint, served by prometheus_client's own ASGI app so
+# scrapes skip FastAPI's endpoint machinery. The Route answers /metrics itself
+# rather than letting Starlette redirect it to the mount at /metrics/.
+metrics_app = make_asgi_app(registry=exposition_registry)
+app.router.routes.append(Route("/metrics", ASGIEndpoint(metrics_app)))
+app.mount("/metrics", metrics_app)
 
 if __name__ == "__main__":
     print("Starting FastAPI Database Server (Demo Mode)")
@@ -221,11 +445,26 @@ if __name__ == "__main__":
     print("Prometheus Metrics: http://localhost:8000/metrics")
     print("Populate Demo Data: http://localhost:8000/demo/populate")
     print("=" * 60)
-    
-    uvicorn.run(
-        "simple_api_server:app",
-        host="0.0.0.0",
-        port=8000,
-        reload=True,
-        log_level="info"
-    )
+
+    if os.environ.get("DEV"):
+        uvicorn.run(
+            "simple_api_server:app",
+            host="0.0.0.0",
+            port=8000,
+            reload=True,
+            loop="uvloop",
+            http="httptools",
+            log_level="info"
+        )
+    else:
+        # Workers don't share memory_store, so more than one is opt-in via WORKERS
+        uvicorn.run(
+            "simple_api_server:app",
+            host="0.0.0.0",
+            port=8000,
+            workers=int(os.environ.get("WORKERS", "1")),
+            loop="uvloop",
+            http="httptools",
+            access_log=False,
+            log_level="warning"
+        )
@@ -16,5 +16,7 @@ if __name__ == "__main__":
         host="127.0.0.1",
         port=8000,
         reload=False,
+        loop="uvloop",
+        http="httptools",
         log_level="info"
     )